@@ -7,35 +7,72 @@ Creates training/artifacts/ with:
   W1.mem  b1.mem  W2.mem  b2.mem        (hex, row-major)
   shift1.txt  shift2.txt                 (int right-shifts for requantization)
   scale_x.txt scale_w1.txt scale_w2.txt  (float info; optional for records)
+  m0_1.mem                               (REQUANT_MULT only: hex int32 L1 multipliers, one per row)
   sample_input.mem  sample_label.txt     (one test image in int8, hex-per-byte)
   golden_pred_int32.txt                  (predicted digit via quantized math)
+  quant_accuracy.txt                     (int8 pipeline accuracy on the full test set)
+  meta.json                              (all of the .txt values in one manifest)
 
-Requantization math (hardware-friendly):
+The per-value .txt files (except quant_accuracy.txt) are only written when LEGACY_ARTIFACTS is set;
+meta.json always is, once, at the end of the run.
+
+Requantization math (hardware-friendly, matches hdl/fc1_layer.v and fc2_layer.v):
   Layer1: int8 x int8 -> int32 acc -> +bias_int32 -> >>> shift1 -> clamp int8 -> ReLU
+
+shift1 = round(log2(scale_h1 / (scale_x * scale_w1))) now scales the accumulator down to the
+observed hidden range (typically ~7-11). Earlier exports used round(log2(M1)), which always
+clamped to 0. hdl/top.v and hdl/top_synthesis.v hardcode shift1 as a localparam, so set it to
+the value this script prints (also in shift1.txt) or the HDL will disagree with the golden prediction.
   Layer2: int8 x int8 -> int32 acc -> +bias_int32 -> (keep int32) -> argmax
+
+With REQUANT_MULT (software only until the HDL gains a multiplier stage), W1 gets one scale
+per row and Layer1 becomes: acc -> * m0_1[j] (64-bit) -> >>> shift1[j] -> clamp int8 -> ReLU,
+so shift1.txt / scale_w1.txt hold 32 per-row values and shift1 is the total shift (>= 31).
 """
 
-import os, math, pathlib, numpy as np, torch, torch.nn as nn, torch.optim as optim
+import os, json, math, pathlib, numpy as np, torch, torch.nn as nn, torch.optim as optim
 from torchvision import datasets, transforms
 
 ROOT = pathlib.Path(__file__).resolve().parent
 ART  = ROOT / "mnist_fpga/hdl/mem_init"
 ART.mkdir(parents=True, exist_ok=True)
 
+# A 128x784x32 GEMM is too small to amortize OpenMP barriers across many cores; a few
+# intra-op threads win. The model is a single chain, so inter-op parallelism buys nothing.
+torch.set_num_threads(min(4, os.cpu_count() or 1))
+torch.set_num_interop_threads(1)
+
 # -----------------------------
 # 1) Data & model definition
 # -----------------------------
 BATCH = 128
-EPOCHS = 3          # small, fast
+EPOCHS = 3          # small, fast (upper bound; stops early once int8 accuracy plateaus)
+VAL = 1000          # held-out train images for the per-epoch int8 accuracy check
+MIN_GAIN = 1e-3     # stop when int8 val accuracy improves by less than 0.1% over an epoch
+MIN_GAIN_N = max(1, round(MIN_GAIN * VAL))   # same threshold in held-out samples (compared exactly)
 HIDDEN = 32
 INPUT  = 28*28      # 784
 OUTPUT = 10
 LR = 1e-3
+COMPILE = True      # torch.compile the training step (falls back to eager if compilation fails)
+# False (default): per-tensor W1 + one >>> shift1 for every neuron, exactly what fc1_layer.v does.
+# True: per-row W1 scales + per-row m0_1 multiply before >>> shift1; the HDL has no multiplier or
+# per-neuron shift table yet, so only enable this for software experiments.
+REQUANT_MULT = False
+# Also write one .txt per metadata value (older scripts / hand-copied HDL params). Contents match
+# the pre-meta.json files only with REQUANT_MULT off; with it on, shift1.txt and scale_w1.txt hold
+# 32 per-row lines and shift1 means the total shift after the m0_1 multiply.
+LEGACY_ARTIFACTS = True
 
 transform = transforms.Compose([transforms.ToTensor()])  # [0,1] float
-train_ds = datasets.MNIST(root=str(ROOT/"data"), train=True, download=True, transform=transform)
+train_ds = datasets.MNIST(root=str(ROOT/"data"), train=True, download=True)
 test_ds  = datasets.MNIST(root=str(ROOT/"data"), train=False, download=True, transform=transform)
-train_loader = torch.utils.data.DataLoader(train_ds, batch_size=BATCH, shuffle=True)
+
+# Whole train set fits in RAM (~190 MB float32): decode once, then slice batches
+# directly instead of running ToTensor + collate per sample through a DataLoader.
+X = train_ds.data.float().div_(255.).view(-1, INPUT)   # (60000,784) same values as ToTensor
+Y = train_ds.targets.long()                             # (60000,)
+N_TRAIN = X.size(0) - VAL                               # last VAL images are held out
 
 class MLP(nn.Module):
     def __init__(self):
@@ -52,168 +89,295 @@ class MLP(nn.Module):
 device = "cpu"
 model = MLP().to(device)
 opt = optim.Adam(model.parameters(), lr=LR)
-loss_fn = nn.CrossEntropyLoss()
 
-# -----------------------------
-# 2) Quick training
-# -----------------------------
-model.train()
-for epoch in range(EPOCHS):
-    for xb, yb in train_loader:
-        xb = xb.to(device)
-        yb = yb.to(device)
-        opt.zero_grad()
-        out = model(xb)
-        loss = loss_fn(out, yb)
-        loss.backward()
-        opt.step()
-print("[Info] Training done.")
+def pick_train_model():
+    # Compiled view shares parameters with `model` (fuses view/fc1/ReLU/fc2 into one region).
+    # Calibration/export keep using eager `model`.
+    if not COMPILE:
+        return model
+    compiled = torch.compile(model, fullgraph=True)
+    try:
+        # forward compiles on the first call and the backward lazily on the first .backward(),
+        # so run both once here: a missing toolchain/unsupported platform surfaces now, not mid-epoch
+        loss_fn(compiled(X[:BATCH].to(device)), Y[:BATCH].to(device)).backward()
+    except Exception as e:
+        print(f"[Warn] torch.compile failed ({type(e).__name__}: {e}); training eagerly.")
+        compiled = model
+    opt.zero_grad()     # warm-up gradients are discarded; no optimizer step was taken
+    return compiled
+
+loss_fn = nn.CrossEntropyLoss()
+train_model = pick_train_model()
 
 # -----------------------------
-# 3) Helper: symmetric int8 scales
+# 2) Helper: symmetric int8 scales
 # -----------------------------
-@torch.no_grad()
-def calc_scale_sym(t: torch.Tensor, int8_max=127):
-    m = t.abs().max().item()
-    return (m / int8_max) if m > 0 else 1.0
+def calc_scale_sym(t: np.ndarray, int8_max=127, dim=None):
+    # dim=None: one per-tensor scale; dim=1 on a weight: one scale per output row
+    m = np.abs(t).max(axis=dim).astype(np.float64)
+    s = np.where(m > 0, m / int8_max, 1.0)
+    return float(s) if dim is None else s
 
 def clamp_int8(a: torch.Tensor):
     return torch.clamp(a, -128, 127).to(torch.int8)
 
-def save_mem_int8(path: pathlib.Path, arr2d: np.ndarray):
-    with open(path, "w") as f:
-        for row in arr2d:
-            f.write(" ".join(f"{(int(v)&0xFF):02x}" for v in row.tolist()) + "\n")
+# Two-char hex string for every byte value; indexing with a uint8 array formats in C
+LUT = np.array([f"{i:02x}" for i in range(256)])
 
-def save_mem_int32(path: pathlib.Path, arr1d: np.ndarray):
-    with open(path, "w") as f:
-        for v in arr1d.tolist():
-            f.write(f"{(int(v)&0xFFFFFFFF):08x}\n")
+def decompose_m(M: float):
+    """Requant multiplier M in (0,1) -> (m0, shift) with M ~= m0 / 2^shift and m0 in [2^30, 2^31)"""
+    if not 0 < M < 1:
+        raise ValueError(f"requant multiplier {M} outside (0,1)")
+    n = 0
+    while M < 0.5:
+        M *= 2
+        n += 1
+    m0 = int(round(M * (1 << 31)))
+    if m0 == (1 << 31):     # mantissa rounded up to 1.0
+        m0 >>= 1
+        n -= 1
+    return m0, n + 31
 
-# -----------------------------
-# 4) Calibration (collect ranges)
-# -----------------------------
-model.eval()
-with torch.no_grad():
-    # sample a small calibration batch
-    calib_x = torch.stack([train_ds[i][0] for i in range(256)]).to(device)  # (256,1,28,28)
-    x_flat  = calib_x.view(256, -1)                                         # (256,784)
+def requantize(acc: np.ndarray, m0: np.ndarray, shift: np.ndarray):
+    # int32 acc -> int8: (acc * m0) >>> shift in 64 bits, clamp; lower bound 0 is the ReLU.
+    # With m0 = 1 this is exactly fc1_layer.v's acc >>> shift_right + saturate + ReLU.
+    return np.clip((acc.astype(np.int64) * m0) >> shift, 0, 127).astype(np.int8)
 
-    # pass once to get typical ranges
-    h1_f = model.act(model.fc1(x_flat))     # float hidden (pre-ReLU already applied)
-    # scales (symmetric)
-    scale_x  = calc_scale_sym(x_flat)       # float -> int8 for inputs
-    scale_w1 = calc_scale_sym(model.fc1.weight.data)
-    scale_w2 = calc_scale_sym(model.fc2.weight.data)
-    # choose an activation target scale using observed hidden range
-    scale_h1_target = calc_scale_sym(h1_f)  # desired post-ReLU dynamic range
+# meta.json key -> legacy .txt file name (keys without one live only in meta.json)
+LEGACY_TXT = {
+    "scale_x": "scale_x.txt", "scale_w1": "scale_w1.txt", "scale_w2": "scale_w2.txt",
+    "shift1": "shift1.txt", "shift2": "shift2.txt", "sample_label": "sample_label.txt",
+    "golden_pred": "golden_pred_int32.txt",
+}
+
+def save_mem_int8(path: pathlib.Path, arr2d: np.ndarray):
+    # two's complement wrap, same as v & 0xFF; int8 reinterprets in place without a copy
+    arr_u8 = arr2d.view(np.uint8) if arr2d.dtype == np.int8 else arr2d.astype(np.uint8)
+    hex2d = LUT[arr_u8]                           # (R,C) hex strings, one fancy-index in C
+    path.write_text("\n".join(" ".join(row) for row in hex2d) + "\n")
+
+def save_mem_int32(path: pathlib.Path, arr1d: np.ndarray):
+    words = np.char.mod("%08x", arr1d.astype(np.int32, copy=False).view(np.uint32))
+    path.write_text("\n".join(words) + "\n")
 
 # -----------------------------
-# 5) Quantize weights & biases
+# 3) Calibration + quantization (rerun each epoch for the int8 check, and once for export)
 # -----------------------------
-@torch.no_grad()
-def quantize_linear(linear: nn.Linear, in_scale: float, w_scale: float):
+@torch.inference_mode()
+def quantize_linear(linear: nn.Linear, in_scale: float, w_scale):
+    # w_scale: scalar (per-tensor) or (out_dim,) array (per-output-channel)
     Wf = linear.weight.data.clone()
     bf = linear.bias.data.clone()
+    w_scale = torch.as_tensor(w_scale, dtype=Wf.dtype)
     # symmetric int8 weights
-    Wq = clamp_int8((Wf / w_scale).round())
+    Wq = clamp_int8((Wf / w_scale.view(-1, 1)).round())
     # bias is stored in int32 accumulator domain: bias_int = round(b / (in_scale * w_scale))
     bias_scale = in_scale * w_scale
     bq = torch.round(bf / bias_scale).to(torch.int32)
     return Wq, bq
 
-W1_q, b1_q = quantize_linear(model.fc1, in_scale=scale_x,  w_scale=scale_w1)
-# For layer2, the "effective" input scale AFTER L1 is (scale_x * scale_w1) / (2^shift1)
-# We don't know shift1 yet; compute it next, then quantize L2 bias with the correct in_scale.
+def quantize_model(model: MLP):
+    # Calibration (collect ranges)
+    model.eval()
+    with torch.inference_mode():
+        # sample a small calibration batch: first 256 train images, already decoded in X
+        x_flat = X[:256].to(device)                                         # (256,784)
+
+        # pass once to get typical ranges
+        h1_f = model.act(model.fc1(x_flat))     # float hidden (pre-ReLU already applied)
+        # (.numpy() shares CPU storage: all stats below come from this single pass, no copies/.item())
+        x_flat_np = x_flat.numpy()
+        h1_f_np   = h1_f.numpy()
+        # scales (symmetric)
+        scale_x  = calc_scale_sym(x_flat_np)       # float -> int8 for inputs
+        # (32,) one per output row with REQUANT_MULT, else one for the whole tensor
+        scale_w1 = calc_scale_sym(model.fc1.weight.data.numpy(), dim=1 if REQUANT_MULT else None)
+        scale_w2 = calc_scale_sym(model.fc2.weight.data.numpy())
+        # choose an activation target scale using observed hidden range
+        scale_h1_target = calc_scale_sym(h1_f_np)  # desired post-ReLU dynamic range
+
+    # Quantize weights & biases
+    W1_q, b1_q = quantize_linear(model.fc1, in_scale=scale_x, w_scale=scale_w1)
+
+    # Requant multiplier(s) & right-shift(s) for hardware
+    # L1 accumulator LSB scale = scale_x * scale_w1. We want output int8 with target
+    # scale_h1_target, so requantization multiplier M1 = scale_x * scale_w1 / scale_h1_target.
+    M1 = scale_x * scale_w1 / scale_h1_target
+    if REQUANT_MULT:
+        # One int32 multiply + arithmetic right shift per row: M1[j] ~= m0_1[j] / 2^shift1[j],
+        # keeping 31 bits of M1 instead of rounding it to a power of two.
+        m0_1, shift1 = (np.array(v, dtype=np.int64) for v in zip(*(decompose_m(float(m)) for m in M1)))
+        # Effective hidden scale that hardware will realize (same for every row):
+        scale_h1_eff = scale_h1_target
+    else:
+        # fc1_layer.v only does acc >>> shift_right, i.e. M1 ~= 2^-shift1. Nearest integer >= 0.
+        shift1 = np.array(max(0, int(round(-math.log2(M1)))), dtype=np.int64)
+        m0_1 = np.array(1, dtype=np.int64)     # pure shift: requantize() multiplies by 1
+        # Effective hidden scale that hardware will realize:
+        scale_h1_eff = scale_x * scale_w1 * 2.0**int(shift1)
+
+    # Now L2's input scale is that effective hidden scale:
+    in2_scale = scale_h1_eff
+    W2_q, b2_q = quantize_linear(model.fc2, in_scale=in2_scale, w_scale=scale_w2)
+    return scale_x, scale_w1, scale_w2, W1_q, b1_q, m0_1, shift1, W2_q, b2_q
+
+def quantize_input(x: np.ndarray, scale_x: float):
+    # float pixels in [0,1] -> int8, same rounding as the exported sample
+    return (x / scale_x).round().clip(-128, 127).astype(np.int8)
+
+# -----------------------------
+# 4) Batched quantized forward (validation / test accuracy)
+# -----------------------------
+def forward_quantized_batch(Xq_int8: np.ndarray, W1_i32, b1_i32, m0_1, shift1, W2_i32, b2_i32):
+    """(N, 784) int8 inputs -> (N,) predictions; same math as forward_quantized, one GEMM per layer"""
+    Acc1 = Xq_int8.astype(np.int32) @ W1_i32.T + b1_i32[None, :]
+    H1 = requantize(Acc1, m0_1, shift1)   # per-row m0_1/shift1 (REQUANT_MULT) broadcast over hidden columns
+    Acc2 = H1.astype(np.int32) @ W2_i32.T + b2_i32[None, :]
+    return Acc2.argmax(1)
+
+def int8_correct(model: MLP, x: np.ndarray, y: np.ndarray):
+    scale_x, _, _, W1_q, b1_q, m0_1, shift1, W2_q, b2_q = quantize_model(model)
+    preds = forward_quantized_batch(quantize_input(x, scale_x),
+                                    W1_q.numpy().astype(np.int32), b1_q.numpy(), m0_1, shift1,
+                                    W2_q.numpy().astype(np.int32), b2_q.numpy())
+    return int((preds == y).sum())
 
 # -----------------------------
-# 6) Compute right-shift(s) for hardware
+# 5) Quick training
 # -----------------------------
-# L1 accumulator LSB scale before shift = scale_x * scale_w1
-acc1_scale = scale_x * scale_w1
-# We want output int8 with target ~ scale_h1_target.
-# Requantization multiplier M1 = acc1_scale / scale_h1_target
-M1 = acc1_scale / (scale_h1_target if scale_h1_target > 0 else 1.0)
-# Hardware does arithmetic right shift by shift1 ~ log2(M1). Use nearest integer >= 0.
-shift1 = max(0, int(round(math.log2(M1)))) if M1 > 0 else 0
-# Effective hidden scale that hardware will realize:
-scale_h1_eff = acc1_scale / (2**shift1)
+X_val, Y_val = X[N_TRAIN:].numpy(), Y[N_TRAIN:].numpy()
+prev_correct = None
+for epoch in range(EPOCHS):
+    model.train()
+    perm = torch.randperm(N_TRAIN)
+    # compiled path drops the ragged last batch: a second batch shape would force a recompile
+    n_used = N_TRAIN - N_TRAIN % BATCH if train_model is not model else N_TRAIN
+    for i in range(0, n_used, BATCH):
+        idx = perm[i:i+BATCH]
+        xb = X[idx].to(device)
+        yb = Y[idx].to(device)
+        opt.zero_grad()
+        out = train_model(xb)
+        loss = loss_fn(out, yb)
+        loss.backward()
+        opt.step()
+    # What ships is the int8 model, so judge convergence on its accuracy, not the float one
+    # (integer counts: float deltas of k/VAL would make a one-sample gain round either way)
+    correct = int8_correct(model, X_val, Y_val)
+    print(f"[Info] Epoch {epoch+1} int8 acc = {correct/VAL*100:.2f}% ({VAL} held-out samples)")
+    if prev_correct is not None and correct - prev_correct < MIN_GAIN_N:
+        print(f"[Info] int8 accuracy plateaued; stopping after epoch {epoch+1}.")
+        break
+    prev_correct = correct
+print("[Info] Training done.")
 
-# Now L2's input scale is that effective hidden scale:
-in2_scale = scale_h1_eff
-W2_q, b2_q = quantize_linear(model.fc2, in_scale=in2_scale, w_scale=scale_w2)
+# -----------------------------
+# 6) Quantize the trained model for export
+# -----------------------------
+scale_x, scale_w1, scale_w2, W1_q, b1_q, m0_1, shift1, W2_q, b2_q = quantize_model(model)
 
-# For L2, we keep logits as int32 and do argmax (no need to shift). If you want, you can also compute a shift2:
-# Just for completeness (unused in hardware if you keep int32):
-# Estimate typical logit magnitude from a small forward and set a conservative shift2 to avoid overflow if needed.
-with torch.no_grad():
-    # rough pass to estimate typical acc2 magnitude
-    h1_q_sim = torch.clamp((h1_f / scale_h1_eff).round(), -128, 127).to(torch.int8)
-    # int32 simulate L2 acc scale = in2_scale * scale_w2
-    acc2_scale = in2_scale * scale_w2
-    # we won't requantize to int8 in hardware, so set shift2 = 0 for clarity
-    shift2 = 0
+# For L2, we keep logits as int32 and do argmax (no requantization in hardware), so shift2 = 0.
+shift2 = 0
 
 # -----------------------------
 # 7) Save params & metadata
 # -----------------------------
-(ART/"scale_x.txt").write_text(f"{scale_x}\n")
-(ART/"scale_w1.txt").write_text(f"{scale_w1}\n")
-(ART/"scale_w2.txt").write_text(f"{scale_w2}\n")
-(ART/"shift1.txt").write_text(f"{shift1}\n")
-(ART/"shift2.txt").write_text(f"{shift2}\n")
+# (collected here, written once at the end together with the golden prediction)
+meta = dict(scale_x=scale_x, scale_w1=scale_w1, scale_w2=scale_w2,
+            shift1=shift1, m0_1=m0_1, shift2=shift2)   # m0_1 = 1 means pure shift
+if REQUANT_MULT:
+    save_mem_int32(ART/"m0_1.mem", m0_1)       # shape (32,)
 
 # Row-major save: each row = one output neuron (i.e., weights[j][:])
 save_mem_int8(ART/"W1.mem", W1_q.numpy())      # shape (32,784)
 save_mem_int32(ART/"b1.mem", b1_q.numpy())     # shape (32,)
 save_mem_int8(ART/"W2.mem", W2_q.numpy())      # shape (10,32)
 save_mem_int32(ART/"b2.mem", b2_q.numpy())     # shape (10,)
-print("[Info] Exported W1/W2/b1/b2 and shift/scales.")
+print("[Info] Exported W1/W2/b1/b2" + (" and m0_1." if REQUANT_MULT else "."))
+if not REQUANT_MULT:
+    print(f"[Info] Set `localparam [5:0] shift1 = 6'd{int(shift1)};` in hdl/top.v and hdl/top_synthesis.v")
 
 # -----------------------------
 # 8) Export one sample input (int8) + golden check
 # -----------------------------
-# Find first sample with digit 3
-test_idx = 0
-for i in range(len(test_ds)):
-    if test_ds[i][1] == 3:
-        test_idx = i
-        break
+# Find first sample with digit 3 (scan labels directly; no per-sample transform)
+test_idx = int((test_ds.targets == 3).nonzero(as_tuple=True)[0][0])
 test_img, test_label = test_ds[test_idx]   # Use first sample with digit 3
 x0 = test_img.view(-1)                      # (784,)
 x0_q = torch.clamp((x0 / scale_x).round(), -128, 127).to(torch.int8)
 
 # Save sample input as hex bytes, 1 per line (easy for $readmemh)
-with open(ART/"sample_input.mem", "w") as f:
-    for v in x0_q.numpy().tolist():
-        f.write(f"{(int(v)&0xFF):02x}\n")
-(ART/"sample_label.txt").write_text(f"{int(test_label)}\n")
+hex_str = x0_q.numpy().view(np.uint8).tobytes().hex()   # one C call for all 784 bytes
+(ART/"sample_input.mem").write_text("\n".join(hex_str[i:i+2] for i in range(0, len(hex_str), 2)) + "\n")
+meta["sample_label"] = int(test_label)
 
 # -----------------------------
-# 9) Quantized forward in Python (mirrors hardware math)
+# 9) Quantized forward in Python (mirrors hardware math unless REQUANT_MULT)
 # -----------------------------
-def int8_mm_int32_acc(Wq: torch.Tensor, xq: torch.Tensor):
-    """(out_dim, in_dim) int8 W times (in_dim,) int8 x -> (out_dim,) int32 acc"""
-    # Use int32 accumulation explicitly
-    return torch.matmul(Wq.to(torch.int32), xq.to(torch.int32))
+def _int_mm_supported():
+    # torch._int_mm is missing on old builds and CUDA-only on some; probe once on CPU
+    if not (hasattr(torch, "_int_mm") and torch.backends.mkldnn.is_available()):
+        return False
+    try:
+        torch._int_mm(torch.zeros(1, 8, dtype=torch.int8), torch.zeros(8, 1, dtype=torch.int8))
+    except RuntimeError:
+        return False
+    return True
+
+USE_INT_MM = _int_mm_supported()
+
+# Constant after quantization: put weights in their final dtype/layout once, outside the hot path.
+# (out_dim, in_dim) row-major already makes each output's dot product a contiguous row walk.
+W1_i32 = np.ascontiguousarray(W1_q.numpy().astype(np.int32))
+W2_i32 = np.ascontiguousarray(W2_q.numpy().astype(np.int32))
+b1_i32 = b1_q.numpy()
+b2_i32 = b2_q.numpy()
+# GEMV operands: int8 tensors when _int_mm can take them as-is, else the int32 copies
+W1_mm = W1_q.contiguous() if USE_INT_MM else W1_i32
+W2_mm = W2_q.contiguous() if USE_INT_MM else W2_i32
+
+def int8_mm_int32_acc(W, xq: np.ndarray):
+    """(out_dim, in_dim) int8-valued W times (in_dim,) int8 x -> (out_dim,) int32 acc"""
+    if USE_INT_MM:
+        # int8 x int8 -> int32 in oneDNN (VNNI on x86, sdot on AArch64); no upcast copies
+        return torch._int_mm(W, torch.from_numpy(xq).view(-1, 1)).view(-1).numpy()
+    return W @ xq.astype(np.int32)
 
-@torch.no_grad()
-def forward_quantized(xq_int8):
-    # L1: acc1 = W1*x + b1  (int32), then >>> shift1, clamp to int8, ReLU
-    acc1 = int8_mm_int32_acc(W1_q, xq_int8) + b1_q
-    h1_q = torch.clamp((acc1 >> shift1), -128, 127).to(torch.int8)
-    h1_q = torch.maximum(h1_q, torch.tensor(0, dtype=torch.int8))  # ReLU
+def forward_quantized(xq_int8: np.ndarray):
+    # L1: acc1 = W1*x + b1  (int32), then >>> shift1 (after * m0_1[j] with REQUANT_MULT), clamp to int8, ReLU
+    acc1 = int8_mm_int32_acc(W1_mm, xq_int8) + b1_i32
+    h1_q = requantize(acc1, m0_1, shift1)
 
     # L2: acc2 = W2*h1_q + b2  (int32). Keep int32 logits; argmax.
-    acc2 = int8_mm_int32_acc(W2_q, h1_q) + b2_q
-    pred = int(torch.argmax(acc2).item())
+    acc2 = int8_mm_int32_acc(W2_mm, h1_q) + b2_i32
+    pred = int(acc2.argmax())
     return pred, acc1, h1_q, acc2
 
 # Run the quantized forward pass and save golden result
-pred_q, acc1_q, h1_q, acc2_q = forward_quantized(x0_q)
-(ART/"golden_pred_int32.txt").write_text(f"{pred_q}\n")
+pred_q, acc1_q, h1_q, acc2_q = forward_quantized(x0_q.numpy())
+meta["golden_pred"] = pred_q
 
 print(f"[Info] Using test sample index {test_idx}")
 print(f"[Info] Sample input quantized forward: predicted digit = {pred_q}")
 print(f"[Info] True label = {test_label}")
 print(f"[Info] Exported sample + golden prediction.")
+
+# -----------------------------
+# 10) Quantized accuracy on the full test set (batched)
+# -----------------------------
+Xtest_q = quantize_input(test_ds.data.numpy().reshape(-1, INPUT).astype(np.float32) / 255., scale_x)
+preds = forward_quantized_batch(Xtest_q, W1_i32, b1_i32, m0_1, shift1, W2_i32, b2_i32)
+quant_acc = float((preds == test_ds.targets.numpy()).mean())
+print(f"[Info] Quantized test accuracy = {quant_acc*100:.2f}% ({len(preds)} samples)")
+(ART/"quant_accuracy.txt").write_text(f"{quant_acc}\n")
+meta["quant_accuracy"] = quant_acc
+
+# -----------------------------
+# 11) Metadata manifest (single write)
+# -----------------------------
+(ART/"meta.json").write_text(json.dumps({k: np.asarray(v).tolist() for k, v in meta.items()}, indent=2) + "\n")
+if LEGACY_ARTIFACTS:
+    for k, name in LEGACY_TXT.items():
+        # one value per line (per-row arrays -> one line per row)
+        (ART/name).write_text("".join(f"{x}\n" for x in np.atleast_1d(meta[k]).tolist()))
+print("[Info] Exported meta.json" + (" + legacy .txt files." if LEGACY_ARTIFACTS else "."))